@@ -1,5 +1,7 @@
 import logging
+from typing import Tuple
 
+import pandas as pd
 import streamlit as st
 
 from aqi_app.controller.aqi_controller import AQIController
@@ -8,16 +10,26 @@ from aqi_app.view import aqi_view
 logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
 
 
+@st.cache_resource(show_spinner=False)
+def get_controller() -> AQIController:
+    return AQIController()
+
+
+@st.cache_data(show_spinner=False, ttl=3600)
+def load_data(limit: int) -> Tuple[pd.DataFrame, pd.DataFrame, str]:
+    return get_controller().load_data(limit=limit)
+
+
 def main() -> None:
     st.set_page_config(page_title="AQI城市排行榜", layout="wide")
-    controller = AQIController()
+    controller = get_controller()
 
     st.sidebar.header("抓取配置")
     limit = st.sidebar.slider("城市数量", min_value=10, max_value=30, value=20, step=2)
     top_n = st.sidebar.slider("排行数量", min_value=3, max_value=5, value=3)
 
     with st.spinner("正在抓取数据并解析..."):
-        df, monthly_df, raw_preview = controller.load_data(limit=limit)
+        df, monthly_df, raw_preview = load_data(limit)
         best, worst = controller.summarize(df, top_n=top_n)
         ordered = controller.to_bar_chart_data(df)
 
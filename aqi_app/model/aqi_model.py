@@ -1,13 +1,40 @@
 import logging
+import os
+import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
 from typing import List, Tuple
 from urllib.parse import quote_plus
 
+import lxml.etree
+import lxml.html
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from requests_cache import CachedSession
+from selectolax.lexbor import LexborHTMLParser
+
+_CITY_AQI_RE = re.compile(r'<a[^>]+data-aqi="(\d+)"[^>]*>\s*([^<\s]+)\s*</a>')
+_ROWS_XPATH = lxml.etree.XPath("(//table)[1]//tr")
+_HEADER_XPATH = lxml.etree.XPath("./th|./td")
+_CELL_XPATH = lxml.etree.XPath("./td")
+
+# Politeness budget shared by all fetch threads: at most _RATE_LIMIT requests per second.
+_RATE_LIMIT = 2
+_RATE_LIMITER = threading.Semaphore(_RATE_LIMIT)
+
+
+def _tick() -> None:
+    _RATE_LIMITER.acquire()
+    timer = threading.Timer(1.0, _RATE_LIMITER.release)
+    timer.daemon = True
+    timer.start()
 
 
 @dataclass
@@ -20,9 +47,23 @@ class AQIModel:
     BASE_URL = "https://www.aqistudy.cn/historydata/index.php"
     ROBOTS_URL = "https://www.aqistudy.cn/robots.txt"
     MONTH_URL = "https://www.aqistudy.cn/historydata/monthdata.php?city={city}"
+    MAX_WORKERS = 8
+    MONTHLY_CACHE_TTL = 24 * 60 * 60
+    POOL_SIZE = 16
+    HTTP_CACHE_NAME = "http_cache"
+    HTTP_CACHE_TTL = 60 * 60
+    MAX_RETRIES = 2
+    RETRY_STATUSES = (500, 502, 503, 504)
 
     def __init__(self, session: requests.Session | None = None, data_dir: str | Path = "data/monthly") -> None:
-        self.session = session or requests.Session()
+        self.data_dir = Path(data_dir)
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        if session is None:
+            session = CachedSession(
+                cache_name=str(self.data_dir / self.HTTP_CACHE_NAME), backend="sqlite", expire_after=self.HTTP_CACHE_TTL
+            )
+            session.mount("https://", HTTPAdapter(pool_connections=self.POOL_SIZE, pool_maxsize=self.POOL_SIZE))
+        self.session = session
         self.session.headers.update(
             {
                 "User-Agent": (
@@ -32,42 +73,72 @@ class AQIModel:
                 )
             }
         )
-        self.data_dir = Path(data_dir)
-        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self._robots_cache: Tuple[bool, str] | None = None
         logging.debug("AQIModel initialized with custom session headers")
 
     def _fetch_text(self, url: str) -> str:
         logging.debug("Fetching URL: %s", url)
-        response = self.session.get(url, timeout=10)
+        response = self._cached_response(url)
+        # Retries live here rather than in the adapter so every attempt draws from the shared rate limit.
+        attempt = 0
+        while response is None:
+            _tick()
+            try:
+                response = self.session.get(url, timeout=10)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.MAX_RETRIES:
+                    raise
+            else:
+                if response.status_code in self.RETRY_STATUSES and attempt < self.MAX_RETRIES:
+                    logging.debug("Retrying %s after status %s", url, response.status_code)
+                    response = None
+            attempt += 1
         response.raise_for_status()
         logging.debug("Received response status: %s", response.status_code)
         return response.text
 
+    def _cached_response(self, url: str) -> requests.Response | None:
+        # Cache hits never reach the site, so they skip the politeness budget.
+        if not isinstance(self.session, CachedSession):
+            return None
+        response = self.session.get(url, only_if_cached=True)
+        return None if response.status_code == 504 else response
+
     def _respect_robots(self) -> Tuple[bool, str]:
+        if self._robots_cache is not None:
+            return self._robots_cache
         try:
             robots_text = self._fetch_text(self.ROBOTS_URL)
             disallow_lines = [line for line in robots_text.splitlines() if line.lower().startswith("disallow")]
             logging.debug("robots.txt disallow lines: %s", disallow_lines)
-            return True, robots_text
+            self._robots_cache = (True, robots_text)
         except requests.RequestException as exc:
             logging.warning("Unable to fetch robots.txt: %s", exc)
-            return False, ""
+            self._robots_cache = (False, "")
+        return self._robots_cache
 
     def fetch_city_aqi(self, limit: int = 10) -> Tuple[List[CityAQI], str]:
         robots_ok, robots_text = self._respect_robots()
         html_text = ""
         cities: List[CityAQI] = []
         try:
-            time.sleep(1)
             html_text = self._fetch_text(self.BASE_URL)
-            soup = BeautifulSoup(html_text, "html.parser")
-            city_list_container = soup.find("div", class_="all")
-            city_links = city_list_container.find_all("a") if city_list_container else []
-            for link in city_links[:limit]:
-                city_name = link.text.strip()
-                aqi_value = link.get("data-aqi") or link.get("aqi")
-                if aqi_value and aqi_value.isdigit():
-                    cities.append(CityAQI(city=city_name, aqi=int(aqi_value)))
+            container = LexborHTMLParser(html_text).css_first("div.all")
+            links = container.css("a") if container else []
+            matches = _CITY_AQI_RE.findall(container.html) if container else []
+            city_aqis: dict[str, int] = {}
+            if len(matches) == len(links):
+                for aqi_value, city_name in matches:
+                    city_aqis.setdefault(city_name, int(aqi_value))
+            else:
+                # The regex only covers plain <a data-aqi>名称</a> links; read every link from the tree otherwise.
+                logging.debug("Regex matched %d of %d city links; parsing links individually", len(matches), len(links))
+                for link in links:
+                    city_name = link.text(strip=True)
+                    aqi_value = link.attributes.get("data-aqi") or link.attributes.get("aqi")
+                    if aqi_value and aqi_value.isdigit():
+                        city_aqis.setdefault(city_name, int(aqi_value))
+            cities = [CityAQI(city=name, aqi=aqi) for name, aqi in list(city_aqis.items())[:limit]]
             logging.debug("Parsed %d cities from live data", len(cities))
         except requests.RequestException as exc:
             logging.error("Failed to fetch live data: %s", exc)
@@ -80,26 +151,40 @@ class AQIModel:
         return cities, robots_text or html_text[:500]
 
     def fetch_city_monthly(self, city: str) -> pd.DataFrame:
-        """Fetch monthly AQI for a single city and persist to CSV.
+        """Fetch monthly AQI for a single city and persist to Parquet.
 
         The target site lists each city's月度数据 in a table; we parse the month
         label (e.g. "2023-12") and AQI列. Any failures fall back to sample data
-        to keep the demo usable offline.
+        to keep the demo usable offline. Only live data is persisted; a file
+        saved within ``MONTHLY_CACHE_TTL`` seconds is reused without touching
+        the network.
         """
 
+        months, aqis = self._fetch_city_monthly_rows(city)
+        return self._monthly_frame([city] * len(months), months, aqis)
+
+    def _fetch_city_monthly_rows(self, city: str) -> Tuple[List[str], List[int]]:
         safe_city = city.replace("/", "-")
-        csv_path = self.data_dir / f"{safe_city}.csv"
-        rows: list[dict[str, str | int]] = []
+        parquet_path = self.data_dir / f"{safe_city}.parquet"
+        if parquet_path.exists() and time.time() - parquet_path.stat().st_mtime < self.MONTHLY_CACHE_TTL:
+            try:
+                cached = pq.read_table(parquet_path, columns=["月份", "AQI"])
+                logging.debug("Reusing cached monthly data for %s from %s", city, parquet_path)
+                return cached.column("月份").to_pylist(), cached.column("AQI").to_pylist()
+            except (OSError, pa.ArrowException) as exc:
+                logging.warning("Ignoring unreadable monthly cache for %s at %s: %s", city, parquet_path, exc)
+
+        months: list[str] = []
+        aqis: list[int] = []
         try:
-            time.sleep(1)
             html_text = self._fetch_text(self.MONTH_URL.format(city=quote_plus(city)))
-            soup = BeautifulSoup(html_text, "html.parser")
-            table = soup.find("table")
-            header_cells = [cell.get_text(strip=True) for cell in table.find("tr").find_all(["th", "td"])] if table else []
+            tree = lxml.html.fromstring(html_text)
+            table_rows = _ROWS_XPATH(tree)
+            header_cells = [cell.text_content().strip() for cell in _HEADER_XPATH(table_rows[0])] if table_rows else []
             aqi_index = next((i for i, h in enumerate(header_cells) if "AQI" in h.upper()), 1)
             month_index = 0
-            for row in table.find_all("tr")[1:] if table else []:
-                cells = [cell.get_text(strip=True) for cell in row.find_all("td")]
+            for row in table_rows[1:]:
+                cells = [cell.text_content().strip() for cell in _CELL_XPATH(row)]
                 if len(cells) <= max(aqi_index, month_index):
                     continue
                 month_label = cells[month_index]
@@ -107,33 +192,60 @@ class AQIModel:
                     aqi_value = int(cells[aqi_index])
                 except ValueError:
                     continue
-                rows.append({"城市": city, "月份": month_label, "AQI": aqi_value})
-            logging.debug("Parsed %d monthly rows for %s", len(rows), city)
+                months.append(month_label)
+                aqis.append(aqi_value)
+            logging.debug("Parsed %d monthly rows for %s", len(months), city)
         except requests.RequestException as exc:
             logging.error("Failed to fetch monthly data for %s: %s", city, exc)
         except Exception as exc:  # pragma: no cover - defensive
             logging.error("Unexpected error parsing monthly data for %s: %s", city, exc)
 
-        if not rows:
-            rows = self._sample_monthly(city)
+        if not months:
             logging.info("Using sample monthly data for %s", city)
+            return self._sample_monthly()
 
-        df = pd.DataFrame(rows)
-        df.to_csv(csv_path, index=False)
-        logging.debug("Saved monthly data for %s to %s", city, csv_path)
-        return df
+        table = pa.table(
+            {
+                "城市": pa.array([city] * len(months), type=pa.string()),
+                "月份": pa.array(months, type=pa.string()),
+                "AQI": pa.array(aqis, type=pa.int16()),
+            }
+        )
+        # Write beside the target and swap it in so readers never see a partial file.
+        tmp_path = parquet_path.with_name(f"{parquet_path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+        pq.write_table(table, tmp_path, compression="zstd")
+        os.replace(tmp_path, parquet_path)
+        logging.debug("Saved monthly data for %s to %s", city, parquet_path)
+        return months, aqis
 
     def fetch_monthly_aqi_for_cities(self, cities: List[str]) -> pd.DataFrame:
-        all_rows: list[pd.DataFrame] = []
         robots_ok, _ = self._respect_robots()
         if not robots_ok:
             logging.info("Proceeding with caution; unable to confirm robots.txt before monthly fetch")
-        for city in cities:
-            all_rows.append(self.fetch_city_monthly(city))
-        combined = pd.concat(all_rows, ignore_index=True)
+        # requests.Session is safe to share for concurrent GETs; its pool keeps connections alive.
+        with ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as executor:
+            results = list(executor.map(self._fetch_city_monthly_rows, cities))
+        city_column: list[str] = []
+        months: list[str] = []
+        aqis: list[int] = []
+        for city, (city_months, city_aqis) in zip(cities, results):
+            city_column.extend([city] * len(city_months))
+            months.extend(city_months)
+            aqis.extend(city_aqis)
+        combined = self._monthly_frame(city_column, months, aqis)
         logging.debug("Combined monthly DataFrame shape: %s", combined.shape)
         return combined
 
+    @staticmethod
+    def _monthly_frame(cities: List[str], months: List[str], aqis: List[int]) -> pd.DataFrame:
+        return pd.DataFrame(
+            {
+                "城市": pd.Categorical(cities),
+                "月份": pd.Categorical(months),
+                "AQI": np.array(aqis, dtype=np.int16),
+            }
+        )
+
     def _sample_data(self, limit: int) -> List[CityAQI]:
         sample = [
             CityAQI("北京", 85),
@@ -153,7 +265,7 @@ class AQIModel:
         logging.debug("Returning %d sample cities", len(limited_sample))
         return limited_sample
 
-    def _sample_monthly(self, city: str) -> list[dict[str, str | int]]:
+    def _sample_monthly(self) -> Tuple[List[str], List[int]]:
         month_values = [
             ("2024-01", 72),
             ("2024-02", 68),
@@ -168,16 +280,20 @@ class AQIModel:
             ("2024-11", 78),
             ("2024-12", 80),
         ]
-        return [{"城市": city, "月份": month, "AQI": value} for month, value in month_values]
+        return [month for month, _ in month_values], [value for _, value in month_values]
 
     def to_dataframe(self, cities: List[CityAQI]) -> pd.DataFrame:
-        df = pd.DataFrame([{"城市": c.city, "AQI": c.aqi} for c in cities])
+        df = pd.DataFrame(
+            {
+                "城市": pd.Categorical([c.city for c in cities]),
+                "AQI": np.fromiter((c.aqi for c in cities), dtype=np.int16, count=len(cities)),
+            }
+        )
         logging.debug("Created DataFrame with shape %s", df.shape)
         return df
 
     def best_and_worst(self, df: pd.DataFrame, top_n: int = 3) -> Tuple[pd.DataFrame, pd.DataFrame]:
-        sorted_df = df.sort_values(by="AQI")
-        best = sorted_df.head(top_n)
-        worst = sorted_df.tail(top_n).iloc[::-1]
+        best = df.nsmallest(top_n, "AQI").reset_index(drop=True)
+        worst = df.nlargest(top_n, "AQI").reset_index(drop=True)
         logging.debug("Calculated best and worst cities")
         return best, worst
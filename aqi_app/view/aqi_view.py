@@ -3,6 +3,21 @@ import pandas as pd
 import altair as alt
 
 
+@st.cache_data(show_spinner=False)
+def _sorted_unique(df: pd.DataFrame, col: str) -> list[str]:
+    return sorted(df[col].unique().tolist())
+
+
+@st.cache_data(show_spinner=False)
+def _top20_by_month(monthly_df: pd.DataFrame) -> pd.DataFrame:
+    return monthly_df.sort_values("AQI", kind="stable").groupby("月份", sort=False, observed=True).head(20)
+
+
+@st.cache_data(show_spinner=False)
+def _city_slices(monthly_df: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    return {city: group.sort_values("月份") for city, group in monthly_df.groupby("城市", sort=False, observed=True)}
+
+
 def render_header(raw_preview: str) -> None:
     st.title("实时AQI抓取与城市排行榜")
     st.markdown(
@@ -22,9 +37,11 @@ def render_table(df: pd.DataFrame) -> None:
 
 def render_insights(best: pd.DataFrame, worst: pd.DataFrame) -> None:
     st.subheader("空气质量概览")
+    c_city = best.columns.get_loc("城市")
+    c_aqi = best.columns.get_loc("AQI")
     cols = st.columns(2)
-    cols[0].metric("空气质量最好 (AQI最低)", best.iloc[0]["城市"], int(best.iloc[0]["AQI"]))
-    cols[1].metric("空气质量最差 (AQI最高)", worst.iloc[0]["城市"], int(worst.iloc[0]["AQI"]))
+    cols[0].metric("空气质量最好 (AQI最低)", best.iat[0, c_city], int(best.iat[0, c_aqi]))
+    cols[1].metric("空气质量最差 (AQI最高)", worst.iat[0, c_city], int(worst.iat[0, c_aqi]))
 
     st.markdown("### 最佳 3 城市")
     st.table(best.reset_index(drop=True))
@@ -34,15 +51,14 @@ def render_insights(best: pd.DataFrame, worst: pd.DataFrame) -> None:
 
 def render_chart(df: pd.DataFrame) -> None:
     st.subheader("城市AQI条形图")
-    chart_data = df.rename(columns={"城市": "city", "AQI": "aqi"})
     chart = (
-        alt.Chart(chart_data)
+        alt.Chart(df)
         .mark_bar()
         .encode(
-            x=alt.X("city", sort="-y", title="城市"),
-            y=alt.Y("aqi", title="AQI数值"),
-            tooltip=["city", "aqi"],
-            color=alt.condition(alt.datum.aqi <= 80, alt.value("#2ecc71"), alt.value("#e74c3c")),
+            x=alt.X("城市:N", sort="-y", title="城市"),
+            y=alt.Y("AQI:Q", title="AQI数值"),
+            tooltip=["城市", "AQI"],
+            color=alt.condition(alt.datum.AQI <= 80, alt.value("#2ecc71"), alt.value("#e74c3c")),
         )
     )
     st.altair_chart(chart, use_container_width=True)
@@ -53,8 +69,8 @@ def render_city_trend(monthly_df: pd.DataFrame) -> None:
     if monthly_df.empty:
         st.info("暂无可用的月度数据。")
         return
-    city = st.selectbox("选择城市", options=sorted(monthly_df["城市"].unique()))
-    filtered = monthly_df[monthly_df["城市"] == city].sort_values("月份")
+    city = st.selectbox("选择城市", options=_sorted_unique(monthly_df, "城市"))
+    filtered = _city_slices(monthly_df)[city]
     line = (
         alt.Chart(filtered)
         .mark_line(point=True)
@@ -68,9 +84,11 @@ def render_monthly_top20(monthly_df: pd.DataFrame) -> None:
     if monthly_df.empty:
         st.info("暂无可用的月度数据。")
         return
-    months = sorted(monthly_df["月份"].unique())
+    months = _sorted_unique(monthly_df, "月份")
     month = st.selectbox("选择月份", options=months)
-    filtered = monthly_df[monthly_df["月份"] == month].sort_values("AQI").head(20)
+    top20 = _top20_by_month(monthly_df)
+    filtered = top20[top20["月份"] == month]
+    median_aqi = float(filtered["AQI"].median())
     chart = (
         alt.Chart(filtered)
         .mark_bar()
@@ -78,7 +96,7 @@ def render_monthly_top20(monthly_df: pd.DataFrame) -> None:
             x=alt.X("城市", sort="-y", title="城市"),
             y=alt.Y("AQI", title="AQI数值"),
             tooltip=["城市", "AQI"],
-            color=alt.condition(alt.datum.AQI <= filtered["AQI"].median(), alt.value("#2ecc71"), alt.value("#e67e22")),
+            color=alt.condition(alt.datum.AQI <= median_aqi, alt.value("#2ecc71"), alt.value("#e67e22")),
         )
     )
     st.altair_chart(chart, use_container_width=True)
@@ -89,7 +107,7 @@ def render_city_comparison(monthly_df: pd.DataFrame) -> None:
     if monthly_df.empty:
         st.info("暂无可用的月度数据。")
         return
-    cities = sorted(monthly_df["城市"].unique())
+    cities = _sorted_unique(monthly_df, "城市")
     col1, col2 = st.columns(2)
     city_a = col1.selectbox("城市 A", options=cities, index=0)
     remaining = [c for c in cities if c != city_a]